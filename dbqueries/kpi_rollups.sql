@@ -111,6 +111,31 @@ LEFT JOIN district_activity_engagement_kpi ac ON a.district_id = ac.district_id
 LEFT JOIN district_teacher_attendance_kpi ta ON a.district_id = ta.district_id
 LEFT JOIN district_inspection_kpi i ON a.district_id = i.district_id;
 
+-- DISTRICT COMPOSITE KPI REPORT
+-- One row per district with every KPI, as read by the Bedrock Lambda
+DROP VIEW IF EXISTS district_composite_kpi_report;
+CREATE VIEW district_composite_kpi_report AS
+SELECT
+    d.district_id,
+    d.district_name,
+    s.state_name,
+    COALESCE(c.district_performance_index, 0) AS performance_index,
+    COALESCE(sa.attendance_percentage, 0) AS student_attendance,
+    COALESCE(ep.pass_percentage, 0) AS pass_rate,
+    COALESCE(sp.sports_participation_rate, 0) AS sports_participation,
+    COALESCE(ae.activity_engagement_rate, 0) AS activity_engagement,
+    COALESCE(ta.teacher_attendance_percentage, 0) AS teacher_attendance,
+    COALESCE(i.avg_inspection_score, 0) AS inspection_score
+FROM district d
+JOIN state s ON d.state_id = s.state_id
+LEFT JOIN district_composite_kpi c ON d.district_id = c.district_id
+LEFT JOIN district_student_attendance_kpi sa ON d.district_id = sa.district_id
+LEFT JOIN district_exam_pass_kpi ep ON d.district_id = ep.district_id
+LEFT JOIN district_sports_participation_kpi sp ON d.district_id = sp.district_id
+LEFT JOIN district_activity_engagement_kpi ae ON d.district_id = ae.district_id
+LEFT JOIN district_teacher_attendance_kpi ta ON d.district_id = ta.district_id
+LEFT JOIN district_inspection_kpi i ON d.district_id = i.district_id;
+
 -- STATE STUDENT ATTENDANCE KPI
 DROP VIEW IF EXISTS state_student_attendance_kpi;
 CREATE VIEW state_student_attendance_kpi AS
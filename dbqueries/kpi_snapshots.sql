@@ -0,0 +1,128 @@
+-- =====================================================
+-- KPI SNAPSHOTS: PRECOMPUTED TABLES
+-- Government School Monitoring System
+-- Compatible with MariaDB 10.5+
+-- =====================================================
+-- Aggregates that are too expensive to compute on every
+-- request are materialized here and refreshed on a schedule
+-- by the event scheduler. On Aurora MySQL, SET GLOBAL is not
+-- permitted: set event_scheduler = ON in the DB cluster
+-- parameter group instead (see MANUAL_SETUP_STEPS.md). Without
+-- it the events below never fire and the snapshots go stale.
+
+-- DISTRICT KPI SNAPSHOT
+-- district_composite_kpi_report (kpi_rollups.sql) stored as a table.
+-- MariaDB has no materialized views, so the report view is copied
+-- here; reads become a scan of one small pre-aggregated table instead
+-- of re-running the seven district KPI aggregates.
+DROP TABLE IF EXISTS district_kpi_snapshot;
+CREATE TABLE district_kpi_snapshot (
+    district_id INT NOT NULL,
+    district_name VARCHAR(150) NOT NULL,
+    state_name VARCHAR(150) NOT NULL,
+    performance_index DECIMAL(8,4) NOT NULL,
+    student_attendance DECIMAL(8,4) NOT NULL,
+    pass_rate DECIMAL(8,4) NOT NULL,
+    sports_participation DECIMAL(8,4) NOT NULL,
+    activity_engagement DECIMAL(8,4) NOT NULL,
+    teacher_attendance DECIMAL(8,4) NOT NULL,
+    inspection_score DECIMAL(8,4) NOT NULL,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (district_id),
+    INDEX ix_performance_index (performance_index)
+) ENGINE=InnoDB;
+
+DROP PROCEDURE IF EXISTS refresh_district_kpi_snapshot;
+DELIMITER //
+CREATE PROCEDURE refresh_district_kpi_snapshot()
+BEGIN
+    START TRANSACTION;
+
+    DELETE FROM district_kpi_snapshot;
+
+    INSERT INTO district_kpi_snapshot
+        (district_id, district_name, state_name, performance_index, student_attendance,
+         pass_rate, sports_participation, activity_engagement, teacher_attendance, inspection_score)
+    SELECT
+        district_id, district_name, state_name, performance_index, student_attendance,
+        pass_rate, sports_participation, activity_engagement, teacher_attendance, inspection_score
+    FROM district_composite_kpi_report;
+
+    COMMIT;
+END //
+DELIMITER ;
+
+DROP EVENT IF EXISTS refresh_district_kpi_snapshot_hourly;
+CREATE EVENT refresh_district_kpi_snapshot_hourly
+ON SCHEDULE EVERY 1 HOUR
+DO CALL refresh_district_kpi_snapshot();
+
+-- STUDENT RISK SNAPSHOT
+-- Per-student exam average and attendance, read by the
+-- Bedrock Lambda's at-risk student analysis
+DROP TABLE IF EXISTS student_risk_snapshot;
+CREATE TABLE student_risk_snapshot (
+    student_id INT NOT NULL,
+    student_name VARCHAR(255) NOT NULL,
+    gender VARCHAR(20),
+    school_name VARCHAR(255),
+    district_name VARCHAR(255),
+    avg_marks DECIMAL(6,2),
+    attendance_pct DECIMAL(5,2),
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (student_id),
+    INDEX ix_avg_marks (avg_marks, attendance_pct),
+    INDEX ix_att (attendance_pct)
+) ENGINE=InnoDB;
+
+DROP PROCEDURE IF EXISTS refresh_student_risk_snapshot;
+DELIMITER //
+CREATE PROCEDURE refresh_student_risk_snapshot()
+BEGIN
+    START TRANSACTION;
+
+    DELETE FROM student_risk_snapshot;
+
+    -- Marks and attendance are aggregated separately so the two
+    -- child tables are not joined into a per-student cross product
+    INSERT INTO student_risk_snapshot
+        (student_id, student_name, gender, school_name, district_name, avg_marks, attendance_pct)
+    SELECT
+        s.student_id,
+        s.student_name,
+        s.gender,
+        sc.school_name,
+        d.district_name,
+        er.avg_marks,
+        sa.attendance_pct
+    FROM student s
+    JOIN school sc ON s.school_id = sc.school_id
+    JOIN block b ON sc.block_id = b.block_id
+    JOIN district d ON b.district_id = d.district_id
+    LEFT JOIN (
+        SELECT student_id, AVG(marks_obtained) AS avg_marks
+        FROM exam_result
+        GROUP BY student_id
+    ) er ON s.student_id = er.student_id
+    LEFT JOIN (
+        SELECT
+            student_id,
+            COUNT(CASE WHEN status = 'Present' THEN 1 END) * 100.0 /
+            NULLIF(COUNT(attendance_id), 0) AS attendance_pct
+        FROM student_attendance
+        GROUP BY student_id
+    ) sa ON s.student_id = sa.student_id
+    WHERE s.status = 'Active';
+
+    COMMIT;
+END //
+DELIMITER ;
+
+DROP EVENT IF EXISTS refresh_student_risk_snapshot_hourly;
+CREATE EVENT refresh_student_risk_snapshot_hourly
+ON SCHEDULE EVERY 1 HOUR
+DO CALL refresh_student_risk_snapshot();
+
+-- Populate once so the snapshots are usable immediately
+CALL refresh_district_kpi_snapshot();
+CALL refresh_student_risk_snapshot();
@@ -4,14 +4,34 @@ Deploy this to AWS Lambda to analyze KPIs with Bedrock
 """
 
 import json
+import time
+import hashlib
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
 import boto3
+import orjson
 import pymysql
 import os
-from datetime import datetime
+from botocore.config import Config
+from datetime import datetime, timezone
+
+# Shared client configuration: a larger connection pool for concurrent
+# calls, adaptive retries that back off on Bedrock throttling, and TCP
+# keepalive so warm invocations reuse their HTTPS connections
+AWS_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'max_attempts': 5, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=120
+)
 
 # Initialize AWS clients
-bedrock = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_REGION', 'us-east-1'))
-s3 = boto3.client('s3')
+AWS_REGION = os.environ.get('AWS_REGION', 'us-east-1')
+bedrock = boto3.client('bedrock-runtime', region_name=AWS_REGION, config=AWS_CONFIG)
+s3 = boto3.client('s3', config=AWS_CONFIG)
+dynamodb = boto3.client('dynamodb', region_name=AWS_REGION, config=AWS_CONFIG)
 
 # Database configuration from environment variables
 DB_HOST = os.environ['DB_HOST']
@@ -20,101 +40,144 @@ DB_PASSWORD = os.environ['DB_PASSWORD']
 DB_NAME = os.environ.get('DB_NAME', 'school_monitoring')
 S3_BUCKET = os.environ.get('S3_BUCKET', 'school-monitoring-reports')
 
-def get_db_connection():
-    """Create database connection to Aurora"""
+# DynamoDB table caching Bedrock responses by prompt (empty to disable)
+CACHE_TABLE = os.environ.get('CACHE_TABLE', 'bedrock_response_cache')
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', 900))
+
+# Bedrock model IDs by short name
+MODELS = {
+    'sonnet': 'anthropic.claude-3-sonnet-20240229-v1:0',
+    'haiku': 'anthropic.claude-3-haiku-20240307-v1:0',
+    'claude-2': 'anthropic.claude-v2:1'
+}
+
+# Default model and output token budget per analysis type. Decode time
+# grows with max_tokens, so short analyses get small budgets and Haiku.
+ANALYSIS_PROFILES = {
+    'quick_summary': ('haiku', 400),
+    'at_risk': ('sonnet', 1500),
+    'at_risk_students': ('sonnet', 1500),
+    'predictive': ('sonnet', 1500),
+    'comprehensive': ('sonnet', 2000)
+}
+DEFAULT_PROFILE = ('haiku', 2000)
+
+# S3 requires every multipart part except the last to be at least 5 MiB
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Prompts estimated above this many tokens are downsampled before sending,
+# keeping well inside Claude 3's 200K context
+MAX_PROMPT_TOKENS = 150_000
+SAMPLE_ROWS = 30
+
+# Cached Aurora connection, reused across warm invocations of this container
+_CONN = None
+
+def _connect(connect_timeout):
+    """Open a new connection to Aurora"""
     return pymysql.connect(
         host=DB_HOST,
         user=DB_USER,
         password=DB_PASSWORD,
         database=DB_NAME,
         cursorclass=pymysql.cursors.DictCursor,
-        connect_timeout=5
+        client_flag=pymysql.constants.CLIENT.MULTI_STATEMENTS,
+        autocommit=True,
+        connect_timeout=connect_timeout
     )
 
-def fetch_district_kpis():
-    """Fetch district KPIs from database views"""
-    conn = get_db_connection()
+def get_db_connection():
+    """Return the cached database connection, reconnecting if it has gone stale"""
+    global _CONN
     
-    query = """
-    SELECT 
-        d.district_name,
-        s.state_name,
-        ROUND(COALESCE(c.district_performance_index, 0), 2) AS performance_index,
-        ROUND(COALESCE(sa.attendance_percentage, 0), 2) AS student_attendance,
-        ROUND(COALESCE(ep.pass_percentage, 0), 2) AS pass_rate,
-        ROUND(COALESCE(sp.sports_participation_rate, 0), 2) AS sports_participation,
-        ROUND(COALESCE(ae.activity_engagement_rate, 0), 2) AS activity_engagement,
-        ROUND(COALESCE(ta.teacher_attendance_percentage, 0), 2) AS teacher_attendance,
-        ROUND(COALESCE(i.avg_inspection_score, 0), 2) AS inspection_score
-    FROM district d
-    JOIN state s ON d.state_id = s.state_id
-    LEFT JOIN district_composite_kpi c ON d.district_id = c.district_id
-    LEFT JOIN district_student_attendance_kpi sa ON d.district_id = sa.district_id
-    LEFT JOIN district_exam_pass_kpi ep ON d.district_id = ep.district_id
-    LEFT JOIN district_sports_participation_kpi sp ON d.district_id = sp.district_id
-    LEFT JOIN district_activity_engagement_kpi ae ON d.district_id = ae.district_id
-    LEFT JOIN district_teacher_attendance_kpi ta ON d.district_id = ta.district_id
-    LEFT JOIN district_inspection_kpi i ON d.district_id = i.district_id
-    ORDER BY c.district_performance_index DESC;
-    """
+    if _CONN is None:
+        _CONN = _connect(connect_timeout=5)
+        return _CONN
     
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(query)
-            results = cursor.fetchall()
-        print(f"Fetched {len(results)} districts from database")
-        return results
-    finally:
-        conn.close()
-
-def fetch_at_risk_students():
-    """Fetch students at risk of dropping out"""
-    conn = get_db_connection()
+        _CONN.ping(reconnect=True)
+    except pymysql.MySQLError as e:
+        print(f"Cached connection unusable ({str(e)}), reconnecting")
+        _CONN = _connect(connect_timeout=10)
     
-    query = """
-    SELECT 
-        s.student_name,
-        s.gender,
-        sc.school_name,
-        d.district_name,
-        ROUND(AVG(er.marks_obtained), 2) as avg_marks,
-        ROUND(COUNT(CASE WHEN sa.status = 'Present' THEN 1 END) * 100.0 / 
-        NULLIF(COUNT(sa.attendance_id), 0), 2) as attendance_pct
-    FROM student s
-    JOIN school sc ON s.school_id = sc.school_id
-    JOIN block b ON sc.block_id = b.block_id
-    JOIN district d ON b.district_id = d.district_id
-    LEFT JOIN exam_result er ON s.student_id = er.student_id
-    LEFT JOIN student_attendance sa ON s.student_id = sa.student_id
-    WHERE s.status = 'Active'
-    GROUP BY s.student_id
-    HAVING avg_marks < 60 OR attendance_pct < 70
-    ORDER BY avg_marks ASC, attendance_pct ASC
-    LIMIT 20;
-    """
-    
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(query)
-            results = cursor.fetchall()
-        print(f"Identified {len(results)} at-risk students")
-        return results
-    finally:
-        conn.close()
+    return _CONN
 
-def create_bedrock_prompt(data, analysis_type='comprehensive'):
-    """Create prompt for Bedrock based on analysis type"""
+# Reads the hourly district_kpi_snapshot table (dbqueries/kpi_snapshots.sql),
+# a stored copy of the district_composite_kpi_report view
+DISTRICT_KPIS_QUERY = """
+SELECT district_name, state_name, performance_index, student_attendance, pass_rate,
+       sports_participation, activity_engagement, teacher_attendance, inspection_score
+FROM district_kpi_snapshot
+ORDER BY performance_index DESC
+"""
+
+# Reads the hourly student_risk_snapshot table (dbqueries/kpi_snapshots.sql)
+# so no aggregation runs on the request path. Each risk condition is its own
+# LIMITed branch that can be served from an index, and only those (at most
+# 40) candidate rows are merged and sorted, instead of sorting every match.
+AT_RISK_STUDENTS_QUERY = """
+SELECT student_name, gender, school_name, district_name, avg_marks, attendance_pct
+FROM (
+    (SELECT student_id, student_name, gender, school_name, district_name, avg_marks, attendance_pct
+     FROM student_risk_snapshot
+     WHERE avg_marks < 60
+     ORDER BY avg_marks ASC, attendance_pct ASC
+     LIMIT 20)
+    UNION
+    (SELECT student_id, student_name, gender, school_name, district_name, avg_marks, attendance_pct
+     FROM student_risk_snapshot
+     WHERE attendance_pct < 70
+     ORDER BY avg_marks ASC, attendance_pct ASC
+     LIMIT 20)
+) candidates
+ORDER BY avg_marks ASC, attendance_pct ASC
+LIMIT 20
+"""
+
+# Datasets that can be fetched, keyed by name
+DATASET_QUERIES = {
+    'districts': DISTRICT_KPIS_QUERY,
+    'at_risk_students': AT_RISK_STUDENTS_QUERY
+}
+
+def dataset_for(analysis_type):
+    """Name of the dataset an analysis type is run against"""
+    return 'at_risk_students' if analysis_type == 'at_risk_students' else 'districts'
+
+def round_row(row):
+    """Round numeric KPI values to 2 places (done here rather than in SQL)"""
+    return {k: round(float(v), 2) if isinstance(v, (float, Decimal)) else v
+            for k, v in row.items()}
+
+def fetch_datasets(names):
+    """
+    Fetch the named datasets ('districts', 'at_risk_students') and return
+    them as {name: rows}. All queries are sent as one multi-statement
+    batch, so fetching several datasets costs a single round trip.
+    """
+    conn = get_db_connection()
+    names = list(names)
+    results = {}
     
-    data_json = json.dumps(data, indent=2)
+    # Unbuffered cursor: rows are decoded one at a time as they are read,
+    # so the driver never holds a second full copy of each result set
+    with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+        cursor.execute(';'.join(DATASET_QUERIES[name] for name in names))
+        for i, name in enumerate(names):
+            if i > 0:
+                cursor.nextset()
+            results[name] = [round_row(row) for row in cursor]
+            print(f"Fetched {len(results[name])} rows for {name}")
     
-    prompts = {
-        'comprehensive': f"""
+    return results
+
+# Prompt (header, footer) pairs by analysis type; the JSON dataset goes between them
+PROMPTS = {
+    'comprehensive': ("""
 You are an expert education data analyst for government schools in India.
 
 Analyze this district performance data:
-
-{data_json}
-
+""", """
 Provide a comprehensive analysis including:
 
 1. EXECUTIVE SUMMARY
@@ -143,13 +206,11 @@ Provide a comprehensive analysis including:
    - Timeline for implementation
 
 Format with clear sections and bullet points.
-""",
-        
-        'at_risk': f"""
+"""),
+    
+    'at_risk': ("""
 Analyze these at-risk districts (performance index < 60):
-
-{data_json}
-
+""", """
 For each district:
 1. RISK LEVEL: High/Medium/Low
 2. PRIMARY ISSUES: What's causing poor performance?
@@ -158,13 +219,11 @@ For each district:
 5. RESOURCES NEEDED: Budget, staff, infrastructure
 
 Prioritize by urgency and feasibility.
-""",
-        
-        'quick_summary': f"""
+"""),
+    
+    'quick_summary': ("""
 Provide a brief summary of district performance:
-
-{data_json}
-
+""", """
 Include:
 - Overall state (1 sentence)
 - Top 3 performers
@@ -172,13 +231,11 @@ Include:
 - One key recommendation
 
 Keep it concise (under 200 words).
-""",
-        
-        'at_risk_students': f"""
+"""),
+    
+    'at_risk_students': ("""
 Analyze these at-risk students:
-
-{data_json}
-
+""", """
 For each student or group:
 1. RISK ASSESSMENT: High/Medium/Low risk level
 2. RISK FACTORS: What's causing the issues?
@@ -187,13 +244,11 @@ For each student or group:
 5. SUCCESS METRICS: How to measure improvement
 
 Prioritize students by risk level.
-""",
-        
-        'predictive': f"""
+"""),
+    
+    'predictive': ("""
 Based on this current performance data:
-
-{data_json}
-
+""", """
 Provide predictive analysis:
 1. TRENDS: Which districts are improving/declining?
 2. PREDICTIONS: Expected performance next quarter
@@ -202,18 +257,64 @@ Provide predictive analysis:
 5. PREVENTIVE ACTIONS: What to do now to improve outcomes
 
 Use data-driven reasoning.
-"""
-    }
+""")
+}
+
+def estimate_tokens(text):
+    """Rough token count for Claude (about 4 characters per token)"""
+    return len(text) // 4
+
+def downsample(data):
+    """
+    Reduce rows to the first and last SAMPLE_ROWS (the datasets are sorted,
+    so these are the best and worst performers) plus one summary row with
+    the mean, median, p5 and p95 of every numeric column
+    """
+    summary = {'summary': 'all_rows', 'total_rows': len(data)}
+    for column in data[0]:
+        values = [row[column] for row in data if row[column] is not None]
+        # Numeric only if every non-null value is; quantiles need two points
+        if len(values) < 2 or not all(
+            isinstance(value, (int, float)) and not isinstance(value, bool) for value in values
+        ):
+            continue
+        quantiles = statistics.quantiles(values, n=20)
+        summary[f"{column}_mean"] = round(statistics.fmean(values), 2)
+        summary[f"{column}_median"] = round(statistics.median(values), 2)
+        summary[f"{column}_p5"] = round(quantiles[0], 2)
+        summary[f"{column}_p95"] = round(quantiles[-1], 2)
     
-    return prompts.get(analysis_type, prompts['comprehensive'])
+    return data[:SAMPLE_ROWS] + data[-SAMPLE_ROWS:] + [summary]
 
-def invoke_bedrock(prompt, model_id='anthropic.claude-3-sonnet-20240229-v1:0'):
-    """Call AWS Bedrock with Claude model"""
+def create_bedrock_prompt(data, analysis_type='comprehensive'):
+    """Create prompt for Bedrock based on analysis type"""
     
-    # Prepare request body for Claude 3
-    body = json.dumps({
+    header, footer = PROMPTS.get(analysis_type, PROMPTS['comprehensive'])
+    # orjson emits compact JSON; indentation would only add billed input tokens
+    prompt = f"{header}\n{orjson.dumps(data).decode('utf-8')}\n{footer}"
+    
+    # Fail fast locally rather than have Bedrock reject an oversized prompt
+    tokens = estimate_tokens(prompt)
+    if tokens > MAX_PROMPT_TOKENS and len(data) > 2 * SAMPLE_ROWS:
+        sample = downsample(data)
+        print(f"Warning: prompt is ~{tokens} tokens; sending {2 * SAMPLE_ROWS} of "
+              f"{len(data)} rows ({2 * SAMPLE_ROWS / len(data):.1%}) plus summary statistics")
+        prompt = f"{header}\n{orjson.dumps(sample).decode('utf-8')}\n{footer}"
+        tokens = estimate_tokens(prompt)
+    
+    if tokens > MAX_PROMPT_TOKENS:
+        raise ValueError(f"Prompt for {analysis_type} is ~{tokens} tokens, over the "
+                         f"{MAX_PROMPT_TOKENS} limit even after downsampling")
+    
+    return prompt
+
+def build_claude_body(prompt, analysis_type='comprehensive'):
+    """Build the Claude 3 messages request body for a prompt"""
+    _, max_tokens = ANALYSIS_PROFILES.get(analysis_type, DEFAULT_PROFILE)
+    
+    return {
         "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 2000,
+        "max_tokens": max_tokens,
         "messages": [
             {
                 "role": "user",
@@ -221,51 +322,251 @@ def invoke_bedrock(prompt, model_id='anthropic.claude-3-sonnet-20240229-v1:0'):
             }
         ],
         "temperature": 0.7,
-        "top_p": 0.9
-    })
+        "top_p": 0.9,
+        "stop_sequences": ["\n\nEnd of Report"]
+    }
+
+def invoke_bedrock(prompt, model_id=MODELS['haiku'], analysis_type='comprehensive', sink=None):
+    """
+    Call AWS Bedrock with Claude model, streaming the response.
+    
+    Each text delta is passed to sink.write() as it arrives (e.g. an
+    S3ReportWriter), so the report upload overlaps with generation.
+    """
+    
+    # Prepare request body for Claude 3
+    body = json.dumps(build_claude_body(prompt, analysis_type))
     
     print(f"Invoking Bedrock model: {model_id}")
     
     # Invoke model
-    response = bedrock.invoke_model(
+    response = bedrock.invoke_model_with_response_stream(
         modelId=model_id,
         body=body
     )
     
-    # Parse response
-    response_body = json.loads(response['body'].read())
-    analysis_text = response_body['content'][0]['text']
+    # Collect text deltas as they are generated
+    parts = []
+    for event in response['body']:
+        chunk = json.loads(event['chunk']['bytes'])
+        if chunk['type'] == 'content_block_delta':
+            text = chunk['delta']['text']
+            parts.append(text)
+            if sink is not None:
+                sink.write(text)
+    
+    analysis_text = ''.join(parts)
     
     print(f"Received response: {len(analysis_text)} characters")
     
     return analysis_text
 
-def save_to_s3(analysis, analysis_type, metadata):
-    """Save analysis results to S3"""
-    try:
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        key = f"reports/{analysis_type}/{timestamp}.json"
+class S3ReportWriter:
+    """
+    Write an analysis report to S3 while the analysis is still streaming in.
+    
+    Text is buffered and shipped as multipart upload parts whenever 5 MiB
+    accumulate; a report that never reaches that size is written with one
+    put_object on close(). Failures are logged and never raised, matching
+    the best-effort behaviour of save_to_s3.
+    """
+    
+    def __init__(self, analysis_type, timestamp=None):
+        self.key = f"reports/{analysis_type}/{time.strftime('%Y%m%d_%H%M%S', time.gmtime())}.json"
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+        self.failed = False
         
-        report = {
-            'timestamp': datetime.now().isoformat(),
-            'analysis_type': analysis_type,
-            'metadata': metadata,
-            'analysis': analysis
-        }
+        # The analysis is the only field not known up front, so the report
+        # is emitted as a JSON prefix, the escaped analysis text, and a suffix
+        self._append(b'{"timestamp":' + orjson.dumps(timestamp or datetime.now(timezone.utc).isoformat())
+                     + b',"analysis_type":' + orjson.dumps(analysis_type) + b',"analysis":"')
+    
+    def write(self, text):
+        """Append a chunk of analysis text to the report"""
+        self._append(orjson.dumps(text)[1:-1])
+    
+    def close(self, metadata):
+        """Finish the report and return its S3 path, or None on failure"""
+        self._append(b'","metadata":' + orjson.dumps(metadata) + b'}')
+        if self.failed:
+            return None
         
-        s3.put_object(
-            Bucket=S3_BUCKET,
-            Key=key,
-            Body=json.dumps(report, indent=2),
-            ContentType='application/json'
-        )
+        try:
+            if self.upload_id is None:
+                s3.put_object(
+                    Bucket=S3_BUCKET,
+                    Key=self.key,
+                    Body=bytes(self.buffer),
+                    ContentType='application/json'
+                )
+            else:
+                self._upload_part()
+                s3.complete_multipart_upload(
+                    Bucket=S3_BUCKET,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.parts}
+                )
+        except Exception as e:
+            self._fail(e)
+            return None
         
-        s3_path = f"s3://{S3_BUCKET}/{key}"
+        s3_path = f"s3://{S3_BUCKET}/{self.key}"
         print(f"Saved report to {s3_path}")
         return s3_path
+    
+    def abort(self, error):
+        """Discard the report, aborting any multipart upload already started"""
+        self._fail(error)
+    
+    def _append(self, data):
+        if self.failed:
+            return
+        self.buffer.extend(data)
+        if len(self.buffer) >= S3_MIN_PART_SIZE:
+            try:
+                if self.upload_id is None:
+                    self.upload_id = s3.create_multipart_upload(
+                        Bucket=S3_BUCKET,
+                        Key=self.key,
+                        ContentType='application/json'
+                    )['UploadId']
+                self._upload_part()
+            except Exception as e:
+                self._fail(e)
+    
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = s3.upload_part(
+            Bucket=S3_BUCKET,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer.clear()
+    
+    def _fail(self, error):
+        print(f"Warning: Could not save to S3: {str(error)}")
+        self.failed = True
+        self.buffer.clear()
+        if self.upload_id is not None:
+            try:
+                s3.abort_multipart_upload(Bucket=S3_BUCKET, Key=self.key, UploadId=self.upload_id)
+            except Exception:
+                pass
+
+def save_to_s3(analysis, analysis_type, metadata, timestamp=None):
+    """Save a complete analysis to S3"""
+    writer = S3ReportWriter(analysis_type, timestamp)
+    writer.write(analysis)
+    return writer.close(metadata)
+
+def cache_key(model_id, body):
+    """Content address of a Bedrock request: the model and the full request body"""
+    return hashlib.sha256(model_id.encode('utf-8') + orjson.dumps(body, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+def get_cached_analysis(key):
+    """Return the cached analysis for key, or None on a miss or cache error"""
+    if not CACHE_TABLE:
+        return None
+    
+    try:
+        item = dynamodb.get_item(
+            TableName=CACHE_TABLE,
+            Key={'cache_key': {'S': key}}
+        ).get('Item')
     except Exception as e:
-        print(f"Warning: Could not save to S3: {str(e)}")
+        print(f"Warning: Could not read response cache: {str(e)}")
+        return None
+    
+    # DynamoDB removes expired items lazily, so the TTL is checked here too
+    if item is None or int(item['expires_at']['N']) <= time.time():
         return None
+    return item['analysis']['S']
+
+def put_cached_analysis(key, analysis):
+    """Store an analysis in the response cache; failures are only logged"""
+    if not CACHE_TABLE:
+        return
+    
+    try:
+        dynamodb.put_item(
+            TableName=CACHE_TABLE,
+            Item={
+                'cache_key': {'S': key},
+                'analysis': {'S': analysis},
+                'expires_at': {'N': str(int(time.time()) + CACHE_TTL_SECONDS)}
+            }
+        )
+    except Exception as e:
+        print(f"Warning: Could not write response cache: {str(e)}")
+
+def model_for(event, analysis_type):
+    """Model short name for an analysis: the event's choice, else the profile default"""
+    return event.get('model') or ANALYSIS_PROFILES.get(analysis_type, DEFAULT_PROFILE)[0]
+
+def run_analysis(analysis_type, data, model_choice, save_s3, timestamp, start_mono, use_cache=True):
+    """
+    Run one analysis over already-fetched data and return its result.
+    Without use_cache, Bedrock is always called (the response is still cached).
+    """
+    
+    # Map model choice to model ID
+    model_id = MODELS.get(model_choice, MODELS['haiku'])
+    
+    # Create prompt
+    prompt = create_bedrock_prompt(data, analysis_type)
+    
+    # Identical requests (prompt, model and inference parameters) within the
+    # cache TTL reuse the earlier response
+    key = cache_key(model_id, build_claude_body(prompt, analysis_type))
+    analysis = get_cached_analysis(key) if use_cache else None
+    cached = analysis is not None
+    
+    writer = None
+    if cached:
+        print(f"Response cache hit: {key}")
+    else:
+        # Call Bedrock, streaming the analysis into S3 if requested
+        writer = S3ReportWriter(analysis_type, timestamp) if save_s3 else None
+        try:
+            analysis = invoke_bedrock(prompt, model_id, analysis_type, sink=writer)
+        except Exception as e:
+            # Uploaded parts of an abandoned multipart upload are billed until aborted
+            if writer is not None:
+                writer.abort(e)
+            raise
+        put_cached_analysis(key, analysis)
+    
+    # Calculate execution time
+    execution_time = time.monotonic() - start_mono
+    
+    # Prepare metadata
+    metadata = {
+        'model': model_choice,
+        'model_id': model_id,
+        'records_analyzed': len(data),
+        'execution_time_seconds': execution_time,
+        'cached': cached
+    }
+    
+    # Finish the S3 report if requested
+    s3_path = None
+    if writer is not None:
+        s3_path = writer.close(metadata)
+    elif save_s3:
+        s3_path = save_to_s3(analysis, analysis_type, metadata, timestamp)
+    
+    return {
+        'analysis_type': analysis_type,
+        'metadata': metadata,
+        's3_path': s3_path,
+        'analysis': analysis
+    }
 
 def lambda_handler(event, context):
     """
@@ -273,31 +574,34 @@ def lambda_handler(event, context):
     
     Event parameters:
     - analysis_type: 'comprehensive', 'at_risk', 'quick_summary', 'at_risk_students', 'predictive'
-    - model: 'sonnet' (default), 'haiku', or 'claude-2'
+    - analysis_types: list of analysis types to run concurrently over one data fetch
+    - model: 'sonnet', 'haiku', or 'claude-2' (default: per analysis type, see ANALYSIS_PROFILES)
     - save_to_s3: true/false (default: true)
+    - bypass_cache: true to skip the response cache and always call Bedrock (default: false)
+    - warm: true to only initialize the environment (DB connection) and return
     """
     
-    start_time = datetime.now()
+    start_mono = time.monotonic()
+    timestamp = datetime.now(timezone.utc).isoformat()
     
     try:
+        if event.get('warm'):
+            get_db_connection()
+            return {'statusCode': 200, 'body': json.dumps({'warm': True})}
+        
+        if 'analysis_types' in event:
+            return run_multi_analysis(event, timestamp, start_mono)
+        
         # Get parameters from event
         analysis_type = event.get('analysis_type', 'comprehensive')
-        model_choice = event.get('model', 'sonnet')
+        model_choice = model_for(event, analysis_type)
         save_s3 = event.get('save_to_s3', True)
         
         print(f"Starting analysis: type={analysis_type}, model={model_choice}")
         
-        # Map model choice to model ID
-        models = {
-            'sonnet': 'anthropic.claude-3-sonnet-20240229-v1:0',
-            'haiku': 'anthropic.claude-3-haiku-20240307-v1:0',
-            'claude-2': 'anthropic.claude-v2:1'
-        }
-        model_id = models.get(model_choice, models['sonnet'])
-        
         # Fetch data based on analysis type
         if analysis_type == 'at_risk_students':
-            data = fetch_at_risk_students()
+            data = fetch_datasets(['at_risk_students'])['at_risk_students']
             if not data:
                 return {
                     'statusCode': 200,
@@ -307,29 +611,10 @@ def lambda_handler(event, context):
                     })
                 }
         else:
-            data = fetch_district_kpis()
-        
-        # Create prompt
-        prompt = create_bedrock_prompt(data, analysis_type)
-        
-        # Call Bedrock
-        analysis = invoke_bedrock(prompt, model_id)
-        
-        # Calculate execution time
-        execution_time = (datetime.now() - start_time).total_seconds()
-        
-        # Prepare metadata
-        metadata = {
-            'model': model_choice,
-            'model_id': model_id,
-            'records_analyzed': len(data),
-            'execution_time_seconds': execution_time
-        }
+            data = fetch_datasets(['districts'])['districts']
         
-        # Save to S3 if requested
-        s3_path = None
-        if save_s3:
-            s3_path = save_to_s3(analysis, analysis_type, metadata)
+        result = run_analysis(analysis_type, data, model_choice, save_s3, timestamp, start_mono,
+                              use_cache=not event.get('bypass_cache', False))
         
         # Return response
         return {
@@ -338,13 +623,7 @@ def lambda_handler(event, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
-                'timestamp': datetime.now().isoformat(),
-                'analysis_type': analysis_type,
-                'metadata': metadata,
-                's3_path': s3_path,
-                'analysis': analysis
-            }, indent=2)
+            'body': json.dumps({'timestamp': timestamp, **result}, indent=2)
         }
         
     except Exception as e:
@@ -359,3 +638,88 @@ def lambda_handler(event, context):
                 'error_type': type(e).__name__
             })
         }
+
+def run_multi_analysis(event, timestamp, start_mono):
+    """
+    Run several analysis types from a single data fetch, invoking Bedrock
+    (and streaming to S3) for all of them concurrently
+    """
+    
+    analysis_types = event['analysis_types']
+    if (not isinstance(analysis_types, list) or not analysis_types
+            or not all(isinstance(t, str) and t in PROMPTS for t in analysis_types)):
+        return {
+            'statusCode': 400,
+            'body': json.dumps({
+                'error': f"analysis_types must be a non-empty list of: {', '.join(PROMPTS)}",
+                'error_type': 'ValueError'
+            })
+        }
+    # One run per type; a repeated type would only duplicate the Bedrock call
+    analysis_types = list(dict.fromkeys(analysis_types))
+    save_s3 = event.get('save_to_s3', True)
+    use_cache = not event.get('bypass_cache', False)
+    
+    print(f"Starting analyses: types={analysis_types}")
+    
+    datasets = fetch_datasets({dataset_for(t) for t in analysis_types})
+    
+    def run(analysis_type):
+        data = datasets[dataset_for(analysis_type)]
+        if not data:
+            return {
+                'analysis_type': analysis_type,
+                'message': 'No records to analyze',
+                'analysis': None
+            }
+        return run_analysis(analysis_type, data, model_for(event, analysis_type),
+                            save_s3, timestamp, start_mono, use_cache)
+    
+    # boto3 clients are thread-safe and AWS_CONFIG's pool covers the fan-out
+    with ThreadPoolExecutor(max_workers=len(analysis_types)) as executor:
+        analyses = list(executor.map(run, analysis_types))
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'timestamp': timestamp,
+            'analysis_types': analysis_types,
+            'analyses': analyses
+        }, indent=2)
+    }
+
+def _load_client_models():
+    """Load botocore's lazily-parsed service models for the calls the handler makes"""
+    bedrock.meta.service_model.operation_model('InvokeModelWithResponseStream')
+    s3.meta.service_model.operation_model('PutObject')
+    dynamodb.meta.service_model.operation_model('GetItem')
+
+def _reconnect_after_restore():
+    """Open a fresh DB connection; sockets do not survive a SnapStart restore"""
+    global _CONN
+    _CONN = None
+    try:
+        get_db_connection()
+    except Exception as e:
+        print(f"Warning: Could not reconnect to database after restore: {str(e)}")
+
+# Cold-start priming. Under SnapStart the parsed client models are captured
+# in the snapshot and the DB connection is opened right after restore; under
+# provisioned concurrency both happen during init, before any request arrives.
+try:
+    from snapshot_restore_py import register_before_snapshot, register_after_restore
+    register_before_snapshot(_load_client_models)
+    register_after_restore(_reconnect_after_restore)
+except ImportError:
+    pass
+
+if os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE') == 'provisioned-concurrency':
+    _load_client_models()
+    try:
+        get_db_connection()
+    except Exception as e:
+        print(f"Warning: Could not pre-connect to database: {str(e)}")
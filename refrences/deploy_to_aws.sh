@@ -15,10 +15,12 @@ echo ""
 # Configuration
 FUNCTION_NAME="SchoolMonitoringBedrockAnalysis"
 ROLE_NAME="SchoolMonitoringLambdaRole"
+ALIAS_NAME="live"  # Published, SnapStart-enabled version callers should invoke
 POLICY_NAME="SchoolMonitoringBedrockPolicy"
 REGION="us-east-1"
-RUNTIME="python3.11"
+RUNTIME="python3.12"  # SnapStart for Python needs 3.12+
 S3_BUCKET="school-monitoring-reports"
+CACHE_TABLE="bedrock_response_cache"
 
 # Get AWS Account ID
 ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text)
@@ -59,11 +61,20 @@ cat > /tmp/bedrock-policy.json <<EOF
         "arn:aws:bedrock:${REGION}::foundation-model/anthropic.claude-v2:1"
       ]
     },
+    {
+      "Effect": "Allow",
+      "Action": [
+        "dynamodb:GetItem",
+        "dynamodb:PutItem"
+      ],
+      "Resource": "arn:aws:dynamodb:${REGION}:${ACCOUNT_ID}:table/${CACHE_TABLE}"
+    },
     {
       "Effect": "Allow",
       "Action": [
         "s3:PutObject",
-        "s3:GetObject"
+        "s3:GetObject",
+        "s3:AbortMultipartUpload"
       ],
       "Resource": "arn:aws:s3:::${S3_BUCKET}/*"
     }
@@ -126,13 +137,29 @@ sleep 10
 
 echo ""
 echo "========================================="
-echo "Step 3: Creating S3 Bucket"
+echo "Step 3: Creating S3 Bucket and Cache Table"
 echo "========================================="
 
 # Create S3 bucket (ignore if exists)
 aws s3 mb s3://$S3_BUCKET --region $REGION 2>/dev/null || echo "Bucket already exists"
 echo "✓ S3 bucket ready: s3://$S3_BUCKET"
 
+# Create response cache table (ignore if exists); items expire via TTL
+aws dynamodb create-table \
+  --table-name $CACHE_TABLE \
+  --attribute-definitions AttributeName=cache_key,AttributeType=S \
+  --key-schema AttributeName=cache_key,KeyType=HASH \
+  --billing-mode PAY_PER_REQUEST \
+  --region $REGION >/dev/null 2>&1 || echo "Cache table already exists"
+
+aws dynamodb wait table-exists --table-name $CACHE_TABLE --region $REGION
+
+aws dynamodb update-time-to-live \
+  --table-name $CACHE_TABLE \
+  --time-to-live-specification Enabled=true,AttributeName=expires_at \
+  --region $REGION >/dev/null 2>&1 || true
+echo "✓ Response cache table ready: $CACHE_TABLE"
+
 echo ""
 echo "========================================="
 echo "Step 4: Packaging Lambda Function"
@@ -146,11 +173,13 @@ cd /tmp/lambda-package
 # Create requirements.txt
 cat > requirements.txt <<EOF
 pymysql==1.1.0
+orjson==3.10.7
 EOF
 
-# Install dependencies
+# Install dependencies (Linux wheels, since orjson is a compiled extension)
 echo "Installing dependencies..."
-pip install -r requirements.txt -t . -q
+pip install -r requirements.txt -t . -q \
+  --platform manylinux2014_x86_64 --only-binary=:all: --python-version ${RUNTIME#python}
 
 # Copy Lambda function
 cp $OLDPWD/bedrock_lambda_function.py lambda_function.py
@@ -177,15 +206,20 @@ if aws lambda get-function --function-name $FUNCTION_NAME --region $REGION 2>/de
       --zip-file fileb:///tmp/school-monitoring-bedrock.zip \
       --region $REGION
     
+    aws lambda wait function-updated --function-name $FUNCTION_NAME --region $REGION
+    
     # Update configuration
     aws lambda update-function-configuration \
       --function-name $FUNCTION_NAME \
+      --runtime $RUNTIME \
+      --snap-start ApplyOn=PublishedVersions \
       --environment Variables="{
         DB_HOST=${DB_HOST},
         DB_USER=${DB_USER},
         DB_PASSWORD=${DB_PASSWORD},
         DB_NAME=${DB_NAME},
         S3_BUCKET=${S3_BUCKET},
+        CACHE_TABLE=${CACHE_TABLE},
         AWS_REGION=${REGION}
       }" \
       --region $REGION
@@ -203,12 +237,14 @@ else
       --zip-file fileb:///tmp/school-monitoring-bedrock.zip \
       --timeout 60 \
       --memory-size 512 \
+      --snap-start ApplyOn=PublishedVersions \
       --environment Variables="{
         DB_HOST=${DB_HOST},
         DB_USER=${DB_USER},
         DB_PASSWORD=${DB_PASSWORD},
         DB_NAME=${DB_NAME},
         S3_BUCKET=${S3_BUCKET},
+        CACHE_TABLE=${CACHE_TABLE},
         AWS_REGION=${REGION}
       }" \
       --vpc-config SubnetIds=${SUBNET_IDS},SecurityGroupIds=${SECURITY_GROUP_ID} \
@@ -217,6 +253,27 @@ else
     echo "✓ Lambda function created"
 fi
 
+# SnapStart only applies to published versions: publish one (this takes the
+# snapshot) and point the alias at it
+aws lambda wait function-updated --function-name $FUNCTION_NAME --region $REGION
+VERSION=$(aws lambda publish-version \
+  --function-name $FUNCTION_NAME \
+  --query Version --output text \
+  --region $REGION)
+
+aws lambda update-alias \
+  --function-name $FUNCTION_NAME \
+  --name $ALIAS_NAME \
+  --function-version $VERSION \
+  --region $REGION >/dev/null 2>&1 || \
+aws lambda create-alias \
+  --function-name $FUNCTION_NAME \
+  --name $ALIAS_NAME \
+  --function-version $VERSION \
+  --region $REGION >/dev/null
+
+echo "✓ Published version $VERSION with SnapStart as alias '$ALIAS_NAME'"
+
 echo ""
 echo "========================================="
 echo "Step 6: Testing Lambda Function"
@@ -233,6 +290,7 @@ EOF
 echo "Invoking Lambda function with test event..."
 aws lambda invoke \
   --function-name $FUNCTION_NAME \
+  --qualifier $ALIAS_NAME \
   --payload file:///tmp/test-event.json \
   --cli-binary-format raw-in-base64-out \
   --region $REGION \
@@ -253,7 +311,7 @@ echo "S3 Bucket: s3://$S3_BUCKET"
 echo ""
 echo "Test the function:"
 echo "  aws lambda invoke \\"
-echo "    --function-name $FUNCTION_NAME \\"
+echo "    --function-name $FUNCTION_NAME --qualifier $ALIAS_NAME \\"
 echo "    --payload '{\"analysis_type\":\"comprehensive\",\"model\":\"sonnet\"}' \\"
 echo "    --cli-binary-format raw-in-base64-out \\"
 echo "    response.json"
@@ -5,18 +5,34 @@ SIMPLE EXAMPLE: How Views + LLMs Work Together
 This shows the complete flow from database views to LLM insights
 """
 
+import asyncio
 import pandas as pd
 import pymysql
 import json
+import time
+
+# Console banners, built once rather than on every print
+BANNER = "=" * 80
+SEP = "-" * 80
+
+# Districts per prompt; larger result sets are split into several prompts
+# that are analyzed concurrently (or as one batch job, for Claude)
+DISTRICTS_PER_PROMPT = 25
+
+# Longest analyze_with_claude_batch waits for a batch before canceling it
+# (batches can take up to 24 hours to end on their own)
+CLAUDE_BATCH_MAX_WAIT_SECONDS = 3600
 
 # ============================================================================
 # STEP 1: FETCH DATA FROM VIEWS (Fast & Consistent)
 # ============================================================================
 
-def fetch_kpis_from_views():
+def fetch_kpis_from_views(refresh=False):
     """
     Views make this simple! No complex JOINs needed.
-    Views have already calculated all the KPIs.
+    The district KPI views are snapshotted into district_kpi_snapshot
+    (dbqueries/kpi_snapshots.sql), so reads never re-run the aggregates.
+    With refresh, the snapshot is rebuilt first.
     """
     
     # Database connection
@@ -27,24 +43,26 @@ def fetch_kpis_from_views():
         database='school_monitoring'
     )
     
+    if refresh:
+        with conn.cursor() as cursor:
+            cursor.callproc('refresh_district_kpi_snapshot')
+        conn.commit()
+        print("✓ Refreshed district KPI snapshot")
+    
     # Simple query - views do all the heavy lifting!
     query = """
     SELECT 
         district_name,
-        ROUND(district_performance_index, 2) AS performance_index,
-        ROUND(attendance_percentage, 2) AS attendance,
-        ROUND(pass_percentage, 2) AS pass_rate,
-        ROUND(sports_participation_rate, 2) AS sports,
-        ROUND(teacher_attendance_percentage, 2) AS teacher_attendance
-    FROM district_composite_kpi dck
-    JOIN district_student_attendance_kpi dsa USING (district_id)
-    JOIN district_exam_pass_kpi dep USING (district_id)
-    JOIN district_sports_participation_kpi dsp USING (district_id)
-    JOIN district_teacher_attendance_kpi dta USING (district_id)
+        ROUND(performance_index, 2) AS performance_index,
+        ROUND(student_attendance, 2) AS attendance,
+        ROUND(pass_rate, 2) AS pass_rate,
+        ROUND(sports_participation, 2) AS sports,
+        ROUND(teacher_attendance, 2) AS teacher_attendance
+    FROM district_kpi_snapshot
     ORDER BY performance_index DESC;
     """
     
-    # Execute query (fast because views are pre-computed)
+    # Execute query (fast because the snapshot is pre-computed)
     df = pd.read_sql(query, conn)
     conn.close()
     
@@ -60,17 +78,9 @@ def fetch_kpis_from_views():
 # STEP 2: MAP KPIs TO LLM PROMPT (Add Context)
 # ============================================================================
 
-def create_llm_prompt(kpi_data):
-    """
-    Transform KPI data into a well-structured prompt for LLM
-    """
-    
-    # Convert to JSON for LLM
-    data_json = kpi_data.to_json(orient='records', indent=2)
-    
-    # Create structured prompt with context
-    prompt = f"""
-You are an education policy advisor for government schools in India.
+# Prompt text around the district data; it never changes, so it is built
+# once and each prompt is assembled with a single join
+PROMPT_HEADER = """You are an education policy advisor for government schools in India.
 
 CONTEXT:
 - Performance Index: Overall district score (0-100)
@@ -86,7 +96,9 @@ CONTEXT:
   * Teacher Attendance: Teacher attendance percentage
 
 DISTRICT PERFORMANCE DATA:
-{data_json}
+"""
+
+PROMPT_FOOTER = """
 
 ANALYSIS REQUIRED:
 
@@ -116,9 +128,22 @@ ANALYSIS REQUIRED:
 
 Format your response clearly with sections and bullet points.
 """
+
+
+def create_llm_prompts(kpi_data) -> list[str]:
+    """
+    Transform KPI data into well-structured prompts for LLM, one per slice
+    of DISTRICTS_PER_PROMPT districts
+    """
     
-    print("\n✓ Created LLM prompt with context")
-    return prompt
+    prompts = []
+    for start in range(0, max(len(kpi_data), 1), DISTRICTS_PER_PROMPT):
+        # Convert to JSON for LLM
+        data_json = kpi_data.iloc[start:start + DISTRICTS_PER_PROMPT].to_json(orient='records', indent=2)
+        prompts.append(''.join((PROMPT_HEADER, data_json, PROMPT_FOOTER)))
+    
+    print(f"\n✓ Created {len(prompts)} LLM prompt(s) with context")
+    return prompts
 
 
 # ============================================================================
@@ -163,11 +188,12 @@ def analyze_with_claude(prompt):
     return message.content[0].text
 
 
-def analyze_with_bedrock(prompt):
-    """Send to AWS Bedrock"""
+def analyze_with_bedrock(prompt, bedrock=None):
+    """Send to AWS Bedrock (pass a bedrock-runtime client to reuse one)"""
     import boto3
     
-    bedrock = boto3.client('bedrock-runtime', region_name='us-east-1')
+    if bedrock is None:
+        bedrock = boto3.client('bedrock-runtime', region_name='us-east-1')
     
     body = json.dumps({
         "prompt": f"\n\nHuman: {prompt}\n\nAssistant:",
@@ -184,79 +210,147 @@ def analyze_with_bedrock(prompt):
     return response_body['completion']
 
 
+def analyze_with_claude_batch(prompts):
+    """
+    Send prompts to Anthropic Claude as one Message Batch (half the price of
+    individual calls; results usually arrive within minutes). Prompts whose
+    requests did not succeed get None; raises TimeoutError, after canceling
+    the batch, if it has not ended within CLAUDE_BATCH_MAX_WAIT_SECONDS.
+    """
+    import anthropic
+    import os
+    
+    client = anthropic.Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
+    
+    batch = client.messages.batches.create(
+        requests=[
+            {
+                "custom_id": f"prompt-{i}",
+                "params": {
+                    "model": "claude-3-sonnet-20240229",
+                    "max_tokens": 1500,
+                    "messages": [{"role": "user", "content": prompt}],
+                },
+            }
+            for i, prompt in enumerate(prompts)
+        ]
+    )
+    
+    deadline = time.monotonic() + CLAUDE_BATCH_MAX_WAIT_SECONDS
+    while batch.processing_status != "ended":
+        if time.monotonic() >= deadline:
+            client.messages.batches.cancel(batch.id)
+            raise TimeoutError(f"Batch {batch.id} still {batch.processing_status} after "
+                               f"{CLAUDE_BATCH_MAX_WAIT_SECONDS}s; canceled")
+        time.sleep(30)
+        batch = client.messages.batches.retrieve(batch.id)
+    
+    insights = {}
+    for entry in client.messages.batches.results(batch.id):
+        if entry.result.type == "succeeded":
+            insights[entry.custom_id] = entry.result.message.content[0].text
+        else:
+            # errored results carry the API error; canceled/expired ones have none
+            error = getattr(entry.result, 'error', None)
+            detail = f": {error.error.type}: {error.error.message}" if error else ""
+            print(f"Warning: {entry.custom_id} {entry.result.type}{detail}")
+    
+    return [insights.get(f"prompt-{i}") for i in range(len(prompts))]
+
+
+async def analyze_many(prompts, provider='claude'):
+    """
+    Analyze several prompts with one provider ('openai', 'claude' or
+    'bedrock') and return the insights in prompt order. Claude prompts go
+    out as a single batch job; the other providers are called concurrently.
+    """
+    
+    if provider == 'claude' and len(prompts) > 1:
+        return await asyncio.to_thread(analyze_with_claude_batch, prompts)
+    
+    if provider == 'bedrock':
+        import boto3
+        
+        # Clients are thread-safe once created, but creating them from several
+        # threads on the shared default session is not, so build one up front
+        bedrock = boto3.client('bedrock-runtime', region_name='us-east-1')
+        return await asyncio.gather(
+            *(asyncio.to_thread(analyze_with_bedrock, prompt, bedrock) for prompt in prompts)
+        )
+    
+    analyze = {
+        'openai': analyze_with_openai,
+        'claude': analyze_with_claude,
+    }[provider]
+    
+    return await asyncio.gather(*(asyncio.to_thread(analyze, prompt) for prompt in prompts))
+
+
 # ============================================================================
 # STEP 4: DISPLAY INSIGHTS
 # ============================================================================
 
 def display_insights(insights):
     """Display the LLM analysis"""
-    print("\n" + "="*80)
-    print("LLM ANALYSIS RESULTS")
-    print("="*80)
-    print(insights)
-    print("="*80)
+    print(f"\n{BANNER}\nLLM ANALYSIS RESULTS\n{BANNER}\n{insights}\n{BANNER}")
 
 
 # ============================================================================
 # COMPLETE WORKFLOW
 # ============================================================================
 
-def main():
+def main(refresh_views=False):
     """
     Complete workflow: Views → KPIs → LLM → Insights
     """
     
-    print("\n" + "="*80)
-    print("KPI TO LLM WORKFLOW DEMONSTRATION")
-    print("="*80 + "\n")
+    print(f"\n{BANNER}\nKPI TO LLM WORKFLOW DEMONSTRATION\n{BANNER}\n")
     
     # Step 1: Fetch KPIs from views (fast!)
     print("STEP 1: Fetching KPIs from database views...")
-    kpi_data = fetch_kpis_from_views()
+    kpi_data = fetch_kpis_from_views(refresh=refresh_views)
     
-    # Step 2: Create LLM prompt with context
-    print("\nSTEP 2: Creating LLM prompt with business context...")
-    prompt = create_llm_prompt(kpi_data)
+    # Step 2: Create LLM prompts with context
+    print("\nSTEP 2: Creating LLM prompts with business context...")
+    prompts = create_llm_prompts(kpi_data)
+    prompt = prompts[0]
     
     # Show what we're sending to LLM
-    print("\n" + "-"*80)
-    print("PROMPT PREVIEW (first 500 chars):")
-    print("-"*80)
-    print(prompt[:500] + "...")
-    print("-"*80)
+    print(f"\n{SEP}\nPROMPT PREVIEW (first 500 chars):\n{SEP}\n{prompt[:500]}...\n{SEP}")
     
     # Step 3: Send to LLM (uncomment your provider)
     print("\nSTEP 3: Sending to LLM for analysis...")
     print("(Uncomment your preferred LLM provider in the code)")
     
-    # Choose one:
-    # insights = analyze_with_openai(prompt)
-    # insights = analyze_with_claude(prompt)
-    # insights = analyze_with_bedrock(prompt)
+    # Choose one provider: 'openai', 'claude' or 'bedrock'
+    # insights = asyncio.run(analyze_many(prompts, 'claude'))
     
     # For demo, show what would happen
-    print("\n✓ Prompt ready to send to LLM")
-    print("\nTo enable LLM analysis:")
-    print("1. Uncomment one of the analyze_with_* functions")
-    print("2. Set your API key as environment variable:")
-    print("   export OPENAI_API_KEY='your-key'")
-    print("   export ANTHROPIC_API_KEY='your-key'")
-    print("3. Run script again")
+    print(
+        "\n✓ Prompt ready to send to LLM\n"
+        "\nTo enable LLM analysis:\n"
+        "1. Uncomment the analyze_many call and choose a provider\n"
+        "2. Set your API key as environment variable:\n"
+        "   export OPENAI_API_KEY='your-key'\n"
+        "   export ANTHROPIC_API_KEY='your-key'\n"
+        "3. Run script again"
+    )
     
     # Step 4: Display insights (when LLM is enabled)
-    # display_insights(insights)
+    # for insight in insights:
+    #     display_insights(insight)
     
-    print("\n" + "="*80)
-    print("WORKFLOW COMPLETE")
-    print("="*80)
+    print(f"\n{BANNER}\nWORKFLOW COMPLETE\n{BANNER}")
     
     # Show the value of views
-    print("\n💡 WHY VIEWS ARE ESSENTIAL:")
-    print("   - Query took <1 second (views are pre-computed)")
-    print("   - No complex JOINs needed in application code")
-    print("   - Consistent KPI calculations across all queries")
-    print("   - Easy to maintain and update logic")
-    print("   - LLM gets clean, structured data")
+    print(
+        "\n💡 WHY VIEWS ARE ESSENTIAL:\n"
+        "   - Query took <1 second (views are pre-computed)\n"
+        "   - No complex JOINs needed in application code\n"
+        "   - Consistent KPI calculations across all queries\n"
+        "   - Easy to maintain and update logic\n"
+        "   - LLM gets clean, structured data"
+    )
 
 
 # ============================================================================
@@ -295,23 +389,24 @@ def without_views_example():
     ORDER BY performance_index DESC;
     """
     
-    print("\n" + "="*80)
-    print("WITHOUT VIEWS (Don't do this!):")
-    print("="*80)
-    print(complex_query)
-    print("\n❌ Problems:")
-    print("   - Slow (calculates every time)")
-    print("   - Error-prone (complex logic)")
-    print("   - Inconsistent (different queries might calculate differently)")
-    print("   - Hard to maintain")
-    print("   - Difficult to debug")
-    print("\n✅ WITH VIEWS:")
-    print("   SELECT * FROM district_composite_kpi;")
-    print("   - Fast, simple, consistent!")
+    print(f"\n{BANNER}\nWITHOUT VIEWS (Don't do this!):\n{BANNER}\n{complex_query}")
+    print(
+        "\n❌ Problems:\n"
+        "   - Slow (calculates every time)\n"
+        "   - Error-prone (complex logic)\n"
+        "   - Inconsistent (different queries might calculate differently)\n"
+        "   - Hard to maintain\n"
+        "   - Difficult to debug\n"
+        "\n✅ WITH VIEWS:\n"
+        "   SELECT * FROM district_composite_kpi;\n"
+        "   - Fast, simple, consistent!"
+    )
 
 
 if __name__ == "__main__":
-    main()
+    import sys
+    
+    main(refresh_views='--refresh-views' in sys.argv)
     
     # Show the alternative (without views)
     print("\n")
@@ -4,182 +4,464 @@ Test script for AWS Bedrock integration
 Run this locally to test your Lambda function
 """
 
+import asyncio
 import boto3
+import hashlib
 import json
+import orjson
+import os
+import random
+import sys
 import time
-from datetime import datetime
+from aiolimiter import AsyncLimiter
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 # Configuration
 FUNCTION_NAME = 'SchoolMonitoringBedrockAnalysis'
+ALIAS = 'live'  # Published SnapStart version (deploy_to_aws.sh); $LATEST is not snapshotted
 REGION = 'us-east-1'
 
-# Initialize Lambda client
-lambda_client = boto3.client('lambda', region_name=REGION)
+# (analysis_type, model) pairs run by the full suite
+TESTS = (
+    ('quick_summary', 'haiku'),
+    ('comprehensive', 'sonnet'),
+    ('at_risk', 'sonnet'),
+    ('at_risk_students', 'haiku'),
+)
 
-def invoke_lambda(analysis_type, model='sonnet'):
-    """Invoke Lambda function and return results"""
-    
-    print(f"\n{'='*80}")
-    print(f"Testing: {analysis_type} with {model}")
-    print(f"{'='*80}\n")
+# Analysis types runnable on their own as `<analysis_type> [model]`
+ANALYSIS_TYPES = frozenset(analysis_type for analysis_type, _ in TESTS) | {'predictive'}
+
+# Console output. Set BEDROCK_TEST_VERBOSE=1 to print request payloads and
+# full analysis text (otherwise only a preview of each analysis is shown)
+BANNER = "=" * 80
+SEP = "-" * 80
+VERBOSE = os.environ.get('BEDROCK_TEST_VERBOSE', '0') == '1'
+ANALYSIS_PREVIEW_CHARS = 500
+
+# Upper bound on in-flight Lambda invocations during a test run. The client
+# connection pool below is sized well above it, so concurrent invocations
+# never wait for (or re-handshake) a connection; keep POOL_SIZE >= MAX_CONCURRENCY.
+MAX_CONCURRENCY = 4
+POOL_SIZE = 64
+
+# Requests per minute each model's invocations are paced to, kept under the
+# account's Bedrock quotas so the suite is not throttled into backoff
+RATE_LIMITS = {
+    'haiku': AsyncLimiter(50, 60),
+    'sonnet': AsyncLimiter(20, 60),
+}
+
+# Throttling retries for concurrent runs, with exponential backoff and jitter
+THROTTLE_ERRORS = ('ThrottlingException', 'TooManyRequestsException')
+MAX_THROTTLE_RETRIES = 4
+
+# Shared client configuration: keepalive connections reused across calls,
+# adaptive retries on throttling, and a read timeout above the Lambda's 60s
+AWS_CONFIG = Config(
+    region_name=REGION,
+    max_pool_connections=POOL_SIZE,
+    retries={'max_attempts': 3, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=90
+)
+
+# Local cache of successful responses, so repeat runs skip Bedrock entirely
+CACHE_DIR = '.bedrock_cache'
+CACHE_TTL_SECONDS = 3600
+
+# Bump when the Lambda's prompts change so older cached analyses are not reused
+PROMPT_VERSION = 1
+
+# 'logs' shows at most LOG_EVENTS of the events from the last LOG_WINDOW_SECONDS,
+# reading at most LOG_SCAN_MAX_EVENTS per filter_log_events scan
+LOG_WINDOW_SECONDS = 15 * 60
+LOG_EVENTS = 500
+LOG_SCAN_MAX_EVENTS = 5000
+
+# Initialize AWS clients from one shared session
+session = boto3.Session()
+lambda_client = session.client('lambda', config=AWS_CONFIG)
+
+class BedrockInvokeError(Exception):
+    """The Lambda invocation, or the analysis it ran, failed"""
+
+class ThrottledError(BedrockInvokeError):
+    """The Lambda's Bedrock call was rejected for exceeding a rate limit"""
+
+def _raise_if_failed(parsed, **kwargs):
+    """botocore after-call hook: raise function errors instead of returning them"""
+    if parsed.get('FunctionError'):
+        details = parsed['Payload'].read().decode('utf-8') if 'Payload' in parsed else ''
+        raise BedrockInvokeError(f"{parsed['FunctionError']} error: {details}")
+    if parsed.get('StatusCode', 200) != 200:
+        raise BedrockInvokeError(f"Status code {parsed['StatusCode']}")
+
+lambda_client.meta.events.register('after-call.lambda.Invoke', _raise_if_failed)
+
+def throttled(error):
+    """True if error is a rate-limit rejection worth retrying"""
+    if isinstance(error, ClientError):
+        return error.response['Error']['Code'] in THROTTLE_ERRORS
+    return isinstance(error, ThrottledError)
+
+def retry_delay(error, attempt):
+    """
+    Seconds to wait before retrying a throttled call: the service's
+    Retry-After header when it sent one, else exponential backoff with jitter
+    """
+    if isinstance(error, ClientError):
+        headers = error.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+        try:
+            return float(headers['retry-after'])
+        except (KeyError, ValueError):
+            pass
+    return 2 ** attempt + random.random()
+
+def cache_key(payload):
+    """Cache key for a request payload (responses' volatile fields are not part of it)"""
+    key_input = json.dumps({**payload, 'prompt_version': PROMPT_VERSION}, sort_keys=True)
+    return hashlib.blake2b(key_input.encode('utf-8'), digest_size=16).hexdigest()
+
+def read_cache(key):
+    """Return the cached response body for key, or None if missing or expired"""
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    try:
+        if time.time() - os.path.getmtime(path) < CACHE_TTL_SECONDS:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    return None
+
+def write_cache(key, body):
+    """Store a response body in the local cache"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, f"{key}.json"), 'w', encoding='utf-8') as f:
+        json.dump(body, f)
+
+def print_analysis(body, verbose=VERBOSE):
+    """Print a response body's metadata and analysis text (a preview unless verbose)"""
+    analysis = body['analysis']
+    if not verbose and len(analysis) > ANALYSIS_PREVIEW_CHARS:
+        analysis = analysis[:ANALYSIS_PREVIEW_CHARS] + "..."
     
-    payload = {
+    print("\n".join([
+        "\nMetadata:",
+        f"  - Timestamp: {body['timestamp']}",
+        f"  - Analysis Type: {body['analysis_type']}",
+        f"  - Records Analyzed: {body['metadata']['records_analyzed']}",
+        f"  - Model: {body['metadata']['model']}",
+        f"  - S3 Path: {body.get('s3_path', 'Not saved')}",
+        f"\n{BANNER}",
+        "ANALYSIS RESULTS:",
+        f"{BANNER}\n",
+        analysis,
+        f"\n{BANNER}\n",
+    ]))
+
+def payload_for(analysis_type, model):
+    """Lambda payload for one test"""
+    return {
         'analysis_type': analysis_type,
         'model': model,
         'save_to_s3': True
     }
+
+def invoke_lambda(analysis_type, model='sonnet', use_cache=True, verbose=VERBOSE):
+    """
+    Invoke Lambda function and return results, raising BedrockInvokeError
+    (ThrottledError when rate limited) if the invocation or analysis fails.
+    Without use_cache, both this script's cache and the Lambda's response
+    cache are bypassed.
+    """
     
-    print(f"Invoking Lambda function: {FUNCTION_NAME}")
-    print(f"Payload: {json.dumps(payload, indent=2)}\n")
+    payload = payload_for(analysis_type, model)
     
-    start_time = time.time()
+    # Keyed before the bypass flag is added, so a --no-cache run refreshes
+    # the entry that cached runs read
+    key = cache_key(payload)
+    if not use_cache:
+        payload['bypass_cache'] = True
     
-    try:
-        response = lambda_client.invoke(
-            FunctionName=FUNCTION_NAME,
-            InvocationType='RequestResponse',
-            Payload=json.dumps(payload)
-        )
-        
-        execution_time = time.time() - start_time
-        
-        # Parse response
-        response_payload = json.loads(response['Payload'].read())
-        
-        if response['StatusCode'] == 200:
-            body = json.loads(response_payload['body'])
-            
-            print(f"✓ Success! (Execution time: {execution_time:.2f}s)")
-            print(f"\nMetadata:")
-            print(f"  - Timestamp: {body['timestamp']}")
-            print(f"  - Analysis Type: {body['analysis_type']}")
-            print(f"  - Records Analyzed: {body['metadata']['records_analyzed']}")
-            print(f"  - Model: {body['metadata']['model']}")
-            print(f"  - S3 Path: {body.get('s3_path', 'Not saved')}")
-            
-            print(f"\n{'='*80}")
-            print("ANALYSIS RESULTS:")
-            print(f"{'='*80}\n")
-            print(body['analysis'])
-            print(f"\n{'='*80}\n")
-            
-            return body
-        else:
-            print(f"✗ Error: Status code {response['StatusCode']}")
-            print(response_payload)
-            return None
-            
-    except Exception as e:
-        print(f"✗ Error invoking Lambda: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
-
-def test_all_analysis_types():
-    """Test all analysis types"""
-    
-    print("\n" + "="*80)
-    print("AWS BEDROCK INTEGRATION TEST SUITE")
-    print("="*80)
-    
-    tests = [
-        ('quick_summary', 'haiku'),
-        ('comprehensive', 'sonnet'),
-        ('at_risk', 'sonnet'),
-        ('at_risk_students', 'haiku'),
+    header = [
+        f"\n{BANNER}",
+        f"Testing: {analysis_type} with {model}",
+        f"{BANNER}\n",
+        f"Invoking Lambda function: {FUNCTION_NAME}:{ALIAS}",
     ]
+    if verbose:
+        header.append(f"Payload: {json.dumps(payload, indent=2)}\n")
+    print("\n".join(header))
+    
+    if use_cache:
+        body = read_cache(key)
+        if body is not None:
+            print(f"✓ Cached result ({CACHE_DIR}/{key}.json)")
+            print_analysis(body, verbose)
+            return body
+    
+    start_ns = time.perf_counter_ns()
+    
+    # Function errors are raised by _raise_if_failed; errors the handler
+    # caught come back as a non-200 statusCode in the response
+    response = lambda_client.invoke(
+        FunctionName=FUNCTION_NAME,
+        Qualifier=ALIAS,
+        InvocationType='RequestResponse',
+        Payload=orjson.dumps(payload)
+    )
+    response_payload = orjson.loads(response['Payload'].read())
+    
+    execution_time = (time.perf_counter_ns() - start_ns) / 1e9
+    
+    if response_payload.get('statusCode') != 200:
+        error = response_payload.get('body', '')
+        if any(code in error for code in THROTTLE_ERRORS):
+            raise ThrottledError(error)
+        raise BedrockInvokeError(error)
+    
+    body = orjson.loads(response_payload['body'])
+    
+    print(f"✓ Success! (Execution time: {execution_time:.2f}s)")
+    print_analysis(body, verbose)
+    
+    write_cache(key, body)
+    return body
+
+def warm_invoke():
+    """
+    Send one warm-up invocation; the handler returns before touching Bedrock.
+    Raises BedrockInvokeError if the handler reports a failure (e.g. it could
+    not open its DB connection).
+    """
+    response = lambda_client.invoke(
+        FunctionName=FUNCTION_NAME,
+        Qualifier=ALIAS,
+        InvocationType='RequestResponse',
+        Payload=orjson.dumps({'warm': True})
+    )
+    response_payload = orjson.loads(response['Payload'].read())
+    if response_payload.get('statusCode') != 200:
+        raise BedrockInvokeError(f"Warm-up failed: {response_payload.get('body', '')}")
+
+async def warm_lambda(n=MAX_CONCURRENCY):
+    """
+    Start n execution environments ahead of the real invocations, so the
+    first analyses do not pay the Lambda cold start. Invocations are held
+    open concurrently so Lambda cannot serve them from one sandbox.
+    """
+    
+    start_ns = time.perf_counter_ns()
+    results = await asyncio.gather(
+        *(asyncio.to_thread(warm_invoke) for _ in range(n)),
+        return_exceptions=True
+    )
+    failures = [result for result in results if isinstance(result, BaseException)]
+    for failure in dict.fromkeys(map(str, failures)):
+        print(f"✗ {failure}")
+    warmed = n - len(failures)
+    print(f"Warmed {warmed}/{n} Lambda environments in {(time.perf_counter_ns() - start_ns) / 1e9:.2f}s")
+
+async def ainvoke_lambda(analysis_type, model, semaphore, use_cache=True):
+    """
+    Invoke the Lambda function from a worker thread, paced by the model's
+    rate limit and bounded by semaphore. Throttled calls are retried after
+    retry_delay() until MAX_THROTTLE_RETRIES is reached.
+    """
+    
+    limiter = RATE_LIMITS.get(model, RATE_LIMITS['sonnet'])
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        async with limiter, semaphore:
+            try:
+                return await asyncio.to_thread(invoke_lambda, analysis_type, model, use_cache)
+            except (ClientError, ThrottledError) as e:
+                if attempt == MAX_THROTTLE_RETRIES or not throttled(e):
+                    raise
+                delay = retry_delay(e, attempt)
+                print(f"Throttled: {analysis_type} ({model}), retrying in {delay:.1f}s: {str(e)}")
+        await asyncio.sleep(delay)
+
+def on_progress(done, total):
+    """Report how many tests have finished"""
+    print(f"Progress: {done}/{total}")
+
+async def test_all_analysis_types(use_cache=True):
+    """Test all analysis types concurrently"""
+    
+    print(f"\n{BANNER}\nAWS BEDROCK INTEGRATION TEST SUITE\n{BANNER}")
+    
+    # Warming opens real environments (and DB connections); skip it when
+    # every test will be answered from the local cache
+    if not use_cache or any(read_cache(cache_key(payload_for(*test))) is None for test in TESTS):
+        await warm_lambda(min(MAX_CONCURRENCY, len(TESTS)))
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    done = 0
+    
+    async def run_test(analysis_type, model):
+        nonlocal done
+        try:
+            return await ainvoke_lambda(analysis_type, model, semaphore, use_cache)
+        finally:
+            done += 1
+            on_progress(done, len(TESTS))
+    
+    bodies = await asyncio.gather(
+        *(run_test(analysis_type, model) for analysis_type, model in TESTS),
+        return_exceptions=True
+    )
     
     results = []
     
-    for analysis_type, model in tests:
-        result = invoke_lambda(analysis_type, model)
+    for (analysis_type, model), body in zip(TESTS, bodies):
         results.append({
             'analysis_type': analysis_type,
             'model': model,
-            'success': result is not None
+            'success': body is not None and not isinstance(body, BaseException),
+            'error': str(body) if isinstance(body, BaseException) else None
         })
-        time.sleep(2)  # Brief pause between tests
     
     # Summary
-    print("\n" + "="*80)
-    print("TEST SUMMARY")
-    print("="*80 + "\n")
-    
-    for result in results:
-        status = "✓ PASS" if result['success'] else "✗ FAIL"
-        print(f"{status} - {result['analysis_type']} ({result['model']})")
+    print(f"\n{BANNER}\nTEST SUMMARY\n{BANNER}\n")
+    print("\n".join(
+        f"✓ PASS - {result['analysis_type']} ({result['model']})" if result['success'] else
+        f"✗ FAIL - {result['analysis_type']} ({result['model']}): {result['error'] or 'no result'}"
+        for result in results
+    ))
     
     success_count = sum(1 for r in results if r['success'])
     print(f"\nTotal: {success_count}/{len(results)} tests passed")
 
-def test_specific_analysis(analysis_type='comprehensive', model='sonnet'):
+def test_specific_analysis(analysis_type='comprehensive', model='sonnet', use_cache=True):
     """Test a specific analysis type"""
-    invoke_lambda(analysis_type, model)
+    try:
+        invoke_lambda(analysis_type, model, use_cache)
+    except (BedrockInvokeError, ClientError) as e:
+        print(f"✗ Error invoking Lambda: {str(e)}")
+
+async def recent_stream_events(logs_client, log_group, start_time, streams=5):
+    """
+    Events from the most recently written log streams, fetched concurrently,
+    for callers without logs:FilterLogEvents permission
+    """
+    
+    latest = logs_client.describe_log_streams(
+        logGroupName=log_group,
+        orderBy='LastEventTime',
+        descending=True,
+        limit=streams
+    )['logStreams']
+    
+    responses = await asyncio.gather(*(
+        asyncio.to_thread(
+            logs_client.get_log_events,
+            logGroupName=log_group,
+            logStreamName=stream['logStreamName'],
+            startTime=start_time,
+            limit=50
+        )
+        for stream in latest
+    ))
+    
+    return sorted(
+        (event for response in responses for event in response['events']),
+        key=lambda event: event['timestamp']
+    )
+
+def newest_log_events(logs_client, log_group, start_time):
+    """
+    The newest LOG_EVENTS events across all log streams since start_time.
+    
+    filter_log_events pages run oldest first, so a capped scan of a busy
+    window would return its oldest events. When a scan hits
+    LOG_SCAN_MAX_EVENTS the window is halved toward now and scanned again,
+    until the whole window fits under the cap.
+    """
+    
+    paginator = logs_client.get_paginator('filter_log_events')
+    end_time = int(time.time() * 1000)
+    while True:
+        pages = paginator.paginate(
+            logGroupName=log_group,
+            startTime=start_time,
+            endTime=end_time,
+            PaginationConfig={'MaxItems': LOG_SCAN_MAX_EVENTS}
+        )
+        events = [event for page in pages for event in page['events']]
+        if len(events) < LOG_SCAN_MAX_EVENTS or end_time - start_time <= 1000:
+            return events[-LOG_EVENTS:]
+        start_time = (start_time + end_time) // 2
 
 def check_lambda_logs():
-    """Check recent Lambda logs"""
-    logs_client = boto3.client('logs', region_name=REGION)
+    """Check recent Lambda logs across all log streams"""
+    logs_client = session.client('logs', config=AWS_CONFIG)
     log_group = f'/aws/lambda/{FUNCTION_NAME}'
+    start_time = int((time.time() - LOG_WINDOW_SECONDS) * 1000)
     
     print(f"\nFetching recent logs from {log_group}...")
     
     try:
-        # Get log streams
-        response = logs_client.describe_log_streams(
-            logGroupName=log_group,
-            orderBy='LastEventTime',
-            descending=True,
-            limit=1
-        )
+        try:
+            # One query covers every stream, so events from concurrent
+            # invocations are not missed
+            events = newest_log_events(logs_client, log_group, start_time)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'AccessDeniedException':
+                raise
+            print("No logs:FilterLogEvents permission, reading the latest log streams instead")
+            events = asyncio.run(recent_stream_events(logs_client, log_group, start_time))
         
-        if response['logStreams']:
-            log_stream = response['logStreams'][0]['logStreamName']
-            
-            # Get log events
-            events = logs_client.get_log_events(
-                logGroupName=log_group,
-                logStreamName=log_stream,
-                limit=50
-            )
-            
-            print(f"\nRecent logs from {log_stream}:\n")
-            for event in events['events']:
-                timestamp = datetime.fromtimestamp(event['timestamp']/1000)
-                print(f"[{timestamp}] {event['message']}")
+        if events:
+            lines = [f"\nRecent logs ({len(events)} events):\n"]
+            for event in events:
+                stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['timestamp'] // 1000))
+                lines.append(f"[{stamp}] {event['message'].rstrip()}")
+            sys.stdout.write("\n".join(lines) + "\n")
         else:
-            print("No log streams found")
+            print(f"No log events in the last {LOG_WINDOW_SECONDS // 60} minutes")
             
     except Exception as e:
         print(f"Error fetching logs: {str(e)}")
 
+# Command-line dispatch; each command takes use_cache
+COMMANDS = {
+    'all': lambda use_cache: asyncio.run(test_all_analysis_types(use_cache)),
+    'logs': lambda use_cache: check_lambda_logs(),
+}
+
+USAGE = """
+Usage:
+  python test_bedrock_integration.py all [--no-cache]
+  python test_bedrock_integration.py comprehensive [sonnet|haiku] [--no-cache]
+  python test_bedrock_integration.py at_risk [sonnet|haiku] [--no-cache]
+  python test_bedrock_integration.py quick_summary [sonnet|haiku] [--no-cache]
+  python test_bedrock_integration.py logs"""
+
 def main():
     """Main test function"""
     
-    import sys
+    # Flags may appear anywhere; positional arguments keep their order
+    use_cache = '--no-cache' not in sys.argv
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
     
-    if len(sys.argv) > 1:
-        command = sys.argv[1]
+    if args:
+        command = args[0]
         
-        if command == 'all':
-            test_all_analysis_types()
-        elif command == 'logs':
-            check_lambda_logs()
-        elif command in ['comprehensive', 'at_risk', 'quick_summary', 'at_risk_students', 'predictive']:
-            model = sys.argv[2] if len(sys.argv) > 2 else 'sonnet'
-            test_specific_analysis(command, model)
+        if command in COMMANDS:
+            COMMANDS[command](use_cache)
+        elif command in ANALYSIS_TYPES:
+            model = args[1] if len(args) > 1 else 'sonnet'
+            test_specific_analysis(command, model, use_cache)
         else:
             print(f"Unknown command: {command}")
-            print("\nUsage:")
-            print("  python test_bedrock_integration.py all")
-            print("  python test_bedrock_integration.py comprehensive [sonnet|haiku]")
-            print("  python test_bedrock_integration.py at_risk [sonnet|haiku]")
-            print("  python test_bedrock_integration.py quick_summary [sonnet|haiku]")
-            print("  python test_bedrock_integration.py logs")
+            print(USAGE)
     else:
         # Default: run quick summary test
         print("Running default test (quick_summary with haiku)...")
         print("Use 'python test_bedrock_integration.py all' to run all tests\n")
-        test_specific_analysis('quick_summary', 'haiku')
+        test_specific_analysis('quick_summary', 'haiku', use_cache)
 
 if __name__ == "__main__":
     main()